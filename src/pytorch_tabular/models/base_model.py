@@ -165,6 +165,12 @@ class BaseModel(pl.LightningModule, metaclass=ABCMeta):
         if len(self.custom_optimizer_params) > 0:
             config.optimizer_params = self.custom_optimizer_params
         self.save_hyperparameters(config)
+        # The target range is resolved once, since the output scaling is applied in every forward pass
+        self._target_range = (
+            [tuple(target_range) for target_range in self.hparams.target_range]
+            if self.hparams.task == "regression" and self.hparams.target_range is not None
+            else None
+        )
         # The concatenated output dim of the embedding layer
         self._build_network()
         self._setup_loss()
@@ -417,10 +423,9 @@ class BaseModel(pl.LightningModule, metaclass=ABCMeta):
             torch.Tensor: The output of the model with sigmoid scaling applied
 
         """
-        if (self.hparams.task == "regression") and (self.hparams.target_range is not None):
-            for i in range(self.hparams.output_dim):
-                y_min, y_max = self.hparams.target_range[i]
-                y_hat[:, i] = y_min + nn.Sigmoid()(y_hat[:, i]) * (y_max - y_min)
+        if self._target_range is not None:
+            for i, (y_min, y_max) in enumerate(self._target_range):
+                y_hat[:, i] = y_min + torch.sigmoid(y_hat[:, i]) * (y_max - y_min)
         return y_hat
 
     def pack_output(self, y_hat: torch.Tensor, backbone_features: torch.tensor) -> Dict[str, Any]:
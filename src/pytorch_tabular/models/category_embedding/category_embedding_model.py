@@ -3,15 +3,19 @@
 # For license information, see LICENSE.TXT
 """Category Embedding Model."""
 
+from typing import Any, Dict
+
 import torch
 import torch.nn as nn
 from omegaconf import DictConfig
 
 from pytorch_tabular.models.common.layers import Embedding1dLayer
-from pytorch_tabular.utils import _initialize_layers, _linear_dropout_bn
+from pytorch_tabular.utils import _initialize_layers, _linear_dropout_bn, get_logger
 
 from ..base_model import BaseModel
 
+logger = get_logger(__name__)
+
 
 class CategoryEmbeddingBackbone(nn.Module):
     def __init__(self, config: DictConfig, **kwargs):
@@ -79,3 +83,59 @@ class CategoryEmbeddingModel(BaseModel):
         self._embedding_layer = self._backbone._build_embedding_layer()
         # Head
         self.head = self._get_head_from_config()
+        # A model saved after `fold_continuous_batch_norm` has the normalization absorbed in the backbone weights
+        if self.hparams.get("continuous_batch_norm_folded", False):
+            self._embedding_layer.normalizing_batch_norm = nn.Identity()
+        if self.hparams.get("compile", False):
+            self._compile_network()
+
+    @torch.no_grad()
+    def fold_continuous_batch_norm(self):
+        """Folds the BatchNorm on the continuous inputs into the first linear layer of the backbone.
+
+        In eval mode the normalization is an affine transform of the continuous columns, which can be absorbed in the
+        weights and bias of the linear layer that follows. This removes the normalization pass at inference. The
+        change is not reversible and the model should only be used for inference afterwards. The fold is recorded in
+        the hyperparameters, so that a saved folded model is loaded back without the BatchNorm.
+
+        """
+        if not self.hparams.batch_norm_continuous_input or self.hparams.continuous_dim == 0:
+            logger.warning("Model has no BatchNorm on the continuous inputs to fold. Ignoring.")
+            return
+        if self.hparams.get("continuous_batch_norm_folded", False):
+            logger.warning("The BatchNorm on the continuous inputs is already folded. Ignoring.")
+            return
+        linear = self.backbone.linear_layers[0]
+        if not isinstance(linear, nn.Linear):
+            raise ValueError(
+                "Cannot fold the continuous BatchNorm when the backbone does not start with a Linear layer"
+                " (eg. use_batch_norm=True)"
+            )
+        scale, shift = self.embedding_layer.normalizing_batch_norm.get_eval_affine()
+        # Continuous features are the first `continuous_dim` columns of the embedding layer output
+        cont_weight = linear.weight[:, : self.hparams.continuous_dim]
+        linear.bias.add_(cont_weight @ shift)
+        cont_weight.mul_(scale)
+        self.embedding_layer.normalizing_batch_norm = nn.Identity()
+        self.hparams.continuous_batch_norm_folded = True
+
+    def on_load_checkpoint(self, checkpoint: Dict[str, Any]) -> None:
+        # `TabularModel.load_model` builds the model from the saved config, which does not know about a fold done on
+        # the model. The hyperparameters saved in the checkpoint do, and are checked before the weights are loaded
+        if checkpoint.get("hyper_parameters", {}).get("continuous_batch_norm_folded", False) and not self.hparams.get(
+            "continuous_batch_norm_folded", False
+        ):
+            self.hparams.continuous_batch_norm_folded = True
+            self._embedding_layer.normalizing_batch_norm = nn.Identity()
+        super().on_load_checkpoint(checkpoint)
+
+    def _compile_network(self):
+        if not hasattr(nn.Module, "compile"):
+            logger.warning("Compiling the network needs PyTorch 2.2 or above. Ignoring `compile`.")
+            return
+        # Compiling the modules in place keeps the state dict keys the same as the uncompiled model.
+        # Capping the inputs of a pointwise concat keeps the concat over many embedding columns from being
+        # inlined into the reduction of the normalization that follows, which would break coalesced reads
+        compile_kwargs = {"dynamic": False, "options": {"max_pointwise_cat_inputs": 5}}
+        self._embedding_layer.compile(**compile_kwargs)
+        self._backbone.compile(**compile_kwargs)
@@ -29,6 +29,10 @@ class CategoryEmbeddingModelConfig(ModelConfig):
         dropout (float): DEPRECATED: probability of a classification element to be zeroed. This is added to each
                 linear layer. Defaults to 0.0
 
+        compile (bool): If True, the embedding layer and the backbone are compiled with `torch.compile` so that
+                the embedding lookup, normalization and linear layers are fused into fewer kernels. Needs PyTorch
+                2.2 or above. Defaults to False
+
 
         task (str): Specify whether the problem is regression or classification. `backbone` is a task which
                 considers the model as a backbone to generate features. Mostly used internally for SSL and related
@@ -117,6 +121,17 @@ class CategoryEmbeddingModelConfig(ModelConfig):
         },
     )
 
+    compile: bool = field(
+        default=False,
+        metadata={
+            "help": (
+                "If True, the embedding layer and the backbone are compiled with `torch.compile` so that the"
+                " embedding lookup, normalization and linear layers are fused into fewer kernels."
+                " Needs PyTorch 2.2 or above. Defaults to False"
+            )
+        },
+    )
+
     # def __post_init__(self):
     #     deprecated_args = [
     #         "layers",
@@ -72,6 +72,8 @@ LOG2PI = math.log(2 * math.pi)
 
 class MixtureDensityHead(nn.Module):
     _config_template = head_config.MixtureDensityHeadConfig
+    # Order of the mixture parameters in the fused projection. The ones which always have a bias come first
+    PROJECTIONS = ("pi", "mu", "sigma")
 
     def __init__(self, config: DictConfig, **kwargs):
         self.hparams = config
@@ -79,25 +81,63 @@ class MixtureDensityHead(nn.Module):
         self._build_network()
 
     def _build_network(self):
-        self.pi = nn.Linear(self.hparams.input_dim, self.hparams.num_gaussian)
-        nn.init.normal_(self.pi.weight)
-        self.sigma = nn.Linear(
-            self.hparams.input_dim,
-            self.hparams.num_gaussian,
-            bias=self.hparams.sigma_bias_flag,
-        )
-        self.mu = nn.Linear(self.hparams.input_dim, self.hparams.num_gaussian)
-        nn.init.normal_(self.mu.weight)
+        # Config values used in every forward pass, resolved once
+        self._num_gaussian = int(self.hparams.num_gaussian)
+        self._sigma_bias = bool(self.hparams.sigma_bias_flag)
+        self._softmax_temperature = float(self.hparams.softmax_temperature)
+        # pi, mu and sigma are projected from the input with a single matmul and split afterwards
+        self.projection_weight = nn.Parameter(torch.empty(3 * self.hparams.num_gaussian, self.hparams.input_dim))
+        n_bias = 3 if self.hparams.sigma_bias_flag else 2
+        self.projection_bias = nn.Parameter(torch.empty(n_bias * self.hparams.num_gaussian))
+        self.reset_parameters()
+
+    def reset_parameters(self) -> None:
+        # Same initialization as separate `nn.Linear` layers for pi, mu and sigma
+        nn.init.kaiming_uniform_(self.projection_weight, a=math.sqrt(5))
+        bound = 1 / math.sqrt(self.hparams.input_dim)
+        nn.init.uniform_(self.projection_bias, -bound, bound)
+        pi_weight, mu_weight, _ = self.projection_weight.data.split(self.hparams.num_gaussian)
+        nn.init.normal_(pi_weight)
+        nn.init.normal_(mu_weight)
         if self.hparams.mu_bias_init is not None:
+            mu_bias = self.projection_bias.data[self.hparams.num_gaussian : 2 * self.hparams.num_gaussian]
             for i, bias in enumerate(self.hparams.mu_bias_init):
-                nn.init.constant_(self.mu.bias[i], bias)
+                nn.init.constant_(mu_bias[i], bias)
+
+    def layer_norms(self, p: int) -> torch.Tensor:
+        """Returns the L`p` norm of the weight and bias of each of the `pi`, `mu` and `sigma` layers, in that order.
+
+        The three norms are reduced together from the fused projection.
+
+        """
+        # L1 and L2 are the only supported norms
+        elementwise = torch.abs if p == 1 else torch.square
+        layer_sums = elementwise(self.projection_weight).view(len(self.PROJECTIONS), -1).sum(dim=1)
+        # The layers without a bias come last
+        n_bias = self.projection_bias.size(0) // self._num_gaussian
+        layer_sums[:n_bias] += elementwise(self.projection_bias).view(n_bias, -1).sum(dim=1)
+        return layer_sums if p == 1 else layer_sums.sqrt()
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Checkpoints saved before the projections were fused have separate `pi`, `mu` and `sigma` linear layers
+        legacy_weights = [f"{prefix}{name}.weight" for name in self.PROJECTIONS]
+        if all(k in state_dict for k in legacy_weights):
+            state_dict[f"{prefix}projection_weight"] = torch.cat([state_dict.pop(k) for k in legacy_weights])
+            # sigma has no bias unless `sigma_bias_flag` is set
+            legacy_biases = [k for k in (f"{prefix}{name}.bias" for name in self.PROJECTIONS) if k in state_dict]
+            state_dict[f"{prefix}projection_bias"] = torch.cat([state_dict.pop(k) for k in legacy_biases])
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
 
     def forward(self, x):
-        pi = self.pi(x)
-        sigma = self.sigma(x)
+        if self._sigma_bias:
+            projection = nn.functional.linear(x, self.projection_weight, self.projection_bias)
+        else:
+            # Only pi and mu have a bias, which is added in place to their columns of the projection
+            projection = nn.functional.linear(x, self.projection_weight)
+            projection[..., : self.projection_bias.size(0)] += self.projection_bias
+        pi, mu, sigma = projection.split(self._num_gaussian, dim=-1)
         # Applying modified ELU activation
         sigma = nn.ELU()(sigma) + 1 + 1e-15
-        mu = self.mu(x)
         return pi, sigma, mu
 
     def gaussian_probability(self, sigma, mu, target, log=False):
@@ -124,9 +164,13 @@ class MixtureDensityHead(nn.Module):
         return ret  # torch.prod(ret, 2)
 
     def log_prob(self, pi, sigma, mu, y):
-        log_component_prob = self.gaussian_probability(sigma, mu, y, log=True)
-        log_mix_prob = torch.log(nn.functional.gumbel_softmax(pi, tau=self.hparams.softmax_temperature, dim=-1) + 1e-15)
-        return torch.logsumexp(log_component_prob + log_mix_prob, dim=-1)
+        # Written as a single pointwise chain + reduction over the components, without materializing the
+        # probabilities. The mixing coefficients get the same noise as `nn.functional.gumbel_softmax`, but their log
+        # is taken with a numerically stable log_softmax instead of the log of the softmax
+        z = (y - mu) / sigma
+        gumbels = -torch.empty_like(pi).exponential_().log()
+        log_mix_prob = nn.functional.log_softmax((pi + gumbels) / self._softmax_temperature, dim=-1)
+        return torch.logsumexp(log_mix_prob - torch.log(sigma) - 0.5 * LOG2PI - 0.5 * z * z, dim=-1)
 
     def sample(self, pi, sigma, mu):
         """Draw samples from a MoG."""
@@ -141,7 +185,7 @@ class MixtureDensityHead(nn.Module):
         if n_samples is None:
             n_samples = self.hparams.n_samples
         samples = []
-        softmax_pi = nn.functional.gumbel_softmax(pi, tau=self.hparams.softmax_temperature, dim=-1)
+        softmax_pi = nn.functional.gumbel_softmax(pi, tau=self._softmax_temperature, dim=-1)
         assert (softmax_pi < 0).sum().item() == 0, "pi parameter should not have negative"
         for _ in range(n_samples):
             samples.append(self.sample(softmax_pi, sigma, mu))
@@ -1,3 +1,5 @@
+from typing import Tuple
+
 import numpy as np
 import torch
 from torch import nn
@@ -35,6 +37,40 @@ class BatchNorm1d(nn.Module):
             self.bn = nn.BatchNorm1d(self.num_features)
         else:
             self.bn = GBN(self.num_features, self.virtual_batch_size)
+        # Running statistics and affine parameters folded into a single scale and shift for eval mode, along with the
+        # (storage, version) of the tensors they were folded from, so that they are folded again once any of them
+        # changes, eg. by an optimizer step, a state dict load or a device move
+        self.register_buffer("_eval_scale", None, persistent=False)
+        self.register_buffer("_eval_shift", None, persistent=False)
+        self._eval_folded_from = None
+
+    def train(self, mode: bool = True):
+        super().train(mode)
+        if not mode:
+            self._fold_running_stats()
+        return self
+
+    @torch.no_grad()
+    def get_eval_affine(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Returns the (scale, shift) that the normalization reduces to in eval mode."""
+        bn = self.bn if isinstance(self.bn, nn.BatchNorm1d) else self.bn.bn
+        scale = bn.weight * torch.rsqrt(bn.running_var + bn.eps)
+        return scale, bn.bias - bn.running_mean * scale
+
+    def _fold_state(self) -> Tuple[Tuple[int, int], ...]:
+        bn = self.bn if isinstance(self.bn, nn.BatchNorm1d) else self.bn.bn
+        return tuple((t.data_ptr(), t._version) for t in (bn.weight, bn.bias, bn.running_mean, bn.running_var))
+
+    def _fold_running_stats(self):
+        # eval() may be called inside an inference mode block, but these are reused outside it
+        with torch.inference_mode(False):
+            self._eval_scale, self._eval_shift = self.get_eval_affine()
+        self._eval_folded_from = self._fold_state()
 
     def forward(self, x):
+        # When gradients are not needed in eval mode, normalization is a single fused multiply-add
+        if not self.training and not torch.is_grad_enabled():
+            if self._eval_folded_from != self._fold_state():
+                self._fold_running_stats()
+            return torch.addcmul(self._eval_shift, x, self._eval_scale)
         return self.bn(x)
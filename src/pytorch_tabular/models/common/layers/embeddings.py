@@ -111,6 +111,10 @@ class PreEncoded1dLayer(nn.Module):
 class Embedding1dLayer(nn.Module):
     """Enables different values in a categorical features to have different embeddings."""
 
+    # Largest (batch size x number of categorical columns x largest embedding dim) looked up with a single call when
+    # the embedding dims differ. Measured on CPU, where the padded lookup stops paying off around this size
+    _MAX_FUSED_LOOKUP_ELEMENTS = 2**17
+
     def __init__(
         self,
         continuous_dim: int,
@@ -125,7 +129,33 @@ class Embedding1dLayer(nn.Module):
         self.batch_norm_continuous_input = batch_norm_continuous_input
 
         # Embedding layers
-        self.cat_embedding_layers = nn.ModuleList([nn.Embedding(x, y) for x, y in categorical_embedding_dims])
+        # The embedding tables of all the categorical columns are stacked in a single table, with the rows of the
+        # columns with a smaller embedding dim zero padded to the largest one, so that every column is looked up with
+        # one `F.embedding` call on the indices offset to the rows of their column
+        self._cat_cardinalities = [x for x, _ in categorical_embedding_dims]
+        self._cat_embedding_dims = [y for _, y in categorical_embedding_dims]
+        max_dim = max(self._cat_embedding_dims, default=0)
+        self.cat_embedding_weight = nn.Parameter(torch.empty(sum(self._cat_cardinalities), max_dim))
+        cardinality = torch.tensor(self._cat_cardinalities, dtype=torch.long)
+        self.register_buffer("_cat_offsets", cardinality.cumsum(0) - cardinality, persistent=False)
+        # Indices beyond the cardinality of a column would silently read the rows of the next column in the table
+        self.register_buffer("_cat_cardinality", cardinality, persistent=False)
+        # When the embedding dims differ, the columns of the padded lookup which hold the embeddings
+        self._cat_ragged = any(dim != max_dim for dim in self._cat_embedding_dims)
+        self.register_buffer(
+            "_cat_embed_cols",
+            torch.tensor(
+                [i * max_dim + j for i, dim in enumerate(self._cat_embedding_dims) for j in range(dim)],
+                dtype=torch.long,
+            ),
+            persistent=False,
+        )
+        # The padding is read and written by the single lookup too, which costs more than the per column calls it
+        # saves once the batch is large. Above this batch size the columns are looked up one by one
+        self._cat_max_fused_batch = self._MAX_FUSED_LOOKUP_ELEMENTS // max(len(categorical_embedding_dims) * max_dim, 1)
+        self.reset_parameters()
+        # Dtype the looked up embeddings are cast to when the table is stored in lower precision
+        self._embedding_compute_dtype = None
         if embedding_dropout > 0:
             self.embd_dropout = nn.Dropout(embedding_dropout)
         else:
@@ -133,6 +163,118 @@ class Embedding1dLayer(nn.Module):
         # Continuous Layers
         if batch_norm_continuous_input:
             self.normalizing_batch_norm = BatchNorm1d(continuous_dim, virtual_batch_size)
+        # The inputs present are fixed once the layer is built, so the embedding is specialized here instead of
+        # branching on them in every forward pass
+        self._embed_continuous = self._normalize_continuous if batch_norm_continuous_input else self._identity
+        if len(categorical_embedding_dims) == 0:
+            self._embed = self._embed_continuous_only
+        elif continuous_dim == 0:
+            self._embed = self._embed_categorical_only
+        else:
+            self._embed = self._embed_both
+
+    def to_half_embeddings(self, dtype: torch.dtype = torch.bfloat16) -> "Embedding1dLayer":
+        """Stores the embedding table in a half precision `dtype` for inference.
+
+        The lookups are memory bound, so halving the bytes per row speeds them up. The looked up embeddings are cast
+        back to the original dtype of the table, so the rest of the network is unaffected.
+
+        Args:
+            dtype (torch.dtype): The dtype to store the embedding table in. Defaults to torch.bfloat16
+
+        """
+        if self._embedding_compute_dtype is None:
+            self._embedding_compute_dtype = self.cat_embedding_weight.dtype
+        self.cat_embedding_weight.data = self.cat_embedding_weight.data.to(dtype)
+        return self
+
+    def reset_parameters(self) -> None:
+        # Same initialization as `nn.Embedding`, with the padding of the rows left at zero
+        with torch.no_grad():
+            nn.init.normal_(self.cat_embedding_weight)
+            for table, dim in zip(self.cat_embedding_weight.split(self._cat_cardinalities), self._cat_embedding_dims):
+                table[:, dim:] = 0
+
+    def _cat_embedding_tables(self) -> List[torch.Tensor]:
+        """Returns the (cardinality, embedding_dim) table of each categorical column as a view of the stacked table."""
+        return [
+            table[:, :dim]
+            for table, dim in zip(self.cat_embedding_weight.split(self._cat_cardinalities), self._cat_embedding_dims)
+        ]
+
+    @property
+    def cat_embedding_layers(self) -> nn.ModuleList:
+        """Per column `nn.Embedding` layers sharing storage with the stacked embedding table.
+
+        Used when extracting the learned embeddings
+
+        """
+        tables = self._cat_embedding_tables()
+        if self._embedding_compute_dtype is not None:
+            # A table stored in half precision is extracted in the dtype its embeddings are used in
+            tables = [table.to(self._embedding_compute_dtype) for table in tables]
+        return nn.ModuleList([nn.Embedding.from_pretrained(table.detach(), freeze=True) for table in tables])
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Checkpoints saved before the embedding tables were stacked have one `nn.Embedding` per categorical column
+        legacy_keys = [f"{prefix}cat_embedding_layers.{i}.weight" for i in range(len(self.categorical_embedding_dims))]
+        if len(legacy_keys) > 0 and all(k in state_dict for k in legacy_keys):
+            max_dim = self.cat_embedding_weight.size(1)
+            state_dict[f"{prefix}cat_embedding_weight"] = torch.cat(
+                [
+                    nn.functional.pad(state_dict.pop(k), (0, max_dim - dim))
+                    for k, dim in zip(legacy_keys, self._cat_embedding_dims)
+                ]
+            )
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def _identity(self, continuous_data: torch.Tensor) -> torch.Tensor:
+        return continuous_data
+
+    def _normalize_continuous(self, continuous_data: torch.Tensor) -> torch.Tensor:
+        return self.normalizing_batch_norm(continuous_data)
+
+    def _lookup_fused(self, categorical_data: torch.Tensor) -> torch.Tensor:
+        # Checked on the device, without waiting for the result, like the bounds check of `nn.Embedding`
+        torch._assert_async(((categorical_data >= 0) & (categorical_data < self._cat_cardinality)).all())
+        # (B, N) --> (B, N * max_dim). The indices stay int64: they are a max_dim-th of the output, so casting
+        # them to int32 costs more than the smaller reads save
+        categorical_embed = nn.functional.embedding(
+            categorical_data + self._cat_offsets, self.cat_embedding_weight
+        ).flatten(1)
+        if self._cat_ragged:
+            # (B, N * max_dim) --> (B, sum(embedding_dims))
+            categorical_embed = categorical_embed.index_select(1, self._cat_embed_cols)
+        return categorical_embed
+
+    def _lookup_per_column(self, categorical_data: torch.Tensor) -> torch.Tensor:
+        # (B, sum(embedding_dims))
+        return torch.cat(
+            [
+                nn.functional.embedding(categorical_data[:, i], table)
+                for i, table in enumerate(self._cat_embedding_tables())
+            ],
+            dim=1,
+        )
+
+    def _embed_categorical(self, categorical_data: torch.Tensor) -> torch.Tensor:
+        if self._cat_ragged and categorical_data.size(0) > self._cat_max_fused_batch:
+            categorical_embed = self._lookup_per_column(categorical_data)
+        else:
+            categorical_embed = self._lookup_fused(categorical_data)
+        if self._embedding_compute_dtype is not None:
+            categorical_embed = categorical_embed.to(self._embedding_compute_dtype)
+        return categorical_embed
+
+    def _embed_continuous_only(self, continuous_data: torch.Tensor, categorical_data: torch.Tensor) -> torch.Tensor:
+        return self._embed_continuous(continuous_data)
+
+    def _embed_categorical_only(self, continuous_data: torch.Tensor, categorical_data: torch.Tensor) -> torch.Tensor:
+        return self._embed_categorical(categorical_data)
+
+    def _embed_both(self, continuous_data: torch.Tensor, categorical_data: torch.Tensor) -> torch.Tensor:
+        # (B, N, C + C)
+        return torch.cat([self._embed_continuous(continuous_data), self._embed_categorical(categorical_data)], dim=1)
 
     def forward(self, x: Dict[str, Any]) -> torch.Tensor:
         assert "continuous" in x or "categorical" in x, "x must contain either continuous and categorical features"
@@ -142,33 +284,17 @@ class Embedding1dLayer(nn.Module):
             x.get("categorical", torch.empty(0, 0)),
         )
         assert categorical_data.shape[1] == len(
-            self.cat_embedding_layers
+            self.categorical_embedding_dims
         ), "categorical_data must have same number of columns as categorical embedding layers"
         assert (
             continuous_data.shape[1] == self.continuous_dim
         ), "continuous_data must have same number of columns as continuous dim"
-        embed = None
-        if continuous_data.shape[1] > 0:
-            if self.batch_norm_continuous_input:
-                embed = self.normalizing_batch_norm(continuous_data)
-            else:
-                embed = continuous_data
-            # (B, N, C)
-        if categorical_data.shape[1] > 0:
-            categorical_embed = torch.cat(
-                [
-                    embedding_layer(categorical_data[:, i])
-                    for i, embedding_layer in enumerate(self.cat_embedding_layers)
-                ],
-                dim=1,
-            )
-            # (B, N, C + C)
-            if embed is None:
-                embed = categorical_embed
-            else:
-                embed = torch.cat([embed, categorical_embed], dim=1)
+        embed = self._embed(continuous_data, categorical_data)
         if self.embd_dropout is not None:
-            embed = self.embd_dropout(embed)
+            # Unless it is the raw continuous input, `embed` is freshly allocated here and can be dropped out in place
+            embed = nn.functional.dropout(
+                embed, p=self.embd_dropout.p, training=self.training, inplace=embed is not continuous_data
+            )
         return embed
 
 
@@ -281,14 +407,12 @@ class Embedding2dLayer(nn.Module):
         ), "continuous_data must have same number of columns as continuous dim"
         embed = None
         if continuous_data.shape[1] > 0:
-            cont_idx = torch.arange(self.continuous_dim, device=continuous_data.device).expand(
-                continuous_data.size(0), -1
-            )
             if self.batch_norm_continuous_input:
                 continuous_data = self.normalizing_batch_norm(continuous_data)
+            # Every row looks up the same (N, C) weights, so they are broadcast instead of gathered per sample
             embed = torch.mul(
                 continuous_data.unsqueeze(2),
-                self.cont_embedding_layer(cont_idx),
+                self.cont_embedding_layer.weight,
             )
             if self.embedding_bias:
                 embed += self.cont_embedding_bias
@@ -30,6 +30,9 @@ logger = get_logger(__name__)
 
 
 class MDNModel(BaseModel):
+    # Maximum number of validation rows kept for the histograms
+    _VAL_PLOT_ROWS = 10000
+
     def __init__(self, config: DictConfig, **kwargs):
         assert "inferred_config" in kwargs, "inferred_config not found in initialization arguments"
         self.inferred_config = kwargs["inferred_config"]
@@ -38,7 +41,6 @@ class MDNModel(BaseModel):
         assert self.hparams.output_dim == 1, "MDN is not implemented for multi-targets"
         if config.target_range is not None:
             logger.warning("MDN does not use target range. Ignoring it.")
-        self._val_output = []
 
     def _get_head_from_config(self):
         _head_callable = getattr(blocks, self.hparams.head)
@@ -84,11 +86,40 @@ class MDNModel(BaseModel):
         self._embedding_layer = self._backbone._build_embedding_layer()
         # Head
         self._head = self._get_head_from_config()
+        # Config values used in every step, resolved once
+        self._is_tab_transformer = isinstance(self._backbone, TabTransformerBackbone)
+        self._categorical_dim = int(self.hparams.categorical_dim)
+        self._num_gaussian = int(self.head.hparams.num_gaussian)
+        self._softmax_temperature = float(self.head.hparams.softmax_temperature)
+        self._speedup_training = bool(self.head.hparams.speedup_training)
+        # Weight regularization resolved once so that `calculate_loss` does not check the config every step
+        self._weight_reg_norm = self.head.hparams.weight_regularization
+        weight_reg_lambdas = self._get_weight_regularization_lambdas()
+        self._weight_reg_enabled = any(lambda_ > 0 for lambda_ in weight_reg_lambdas)
+        # Kept on the device so that the regularization is reduced without any host to device copy
+        self.register_buffer(
+            "_weight_reg_lambdas", torch.tensor(weight_reg_lambdas, dtype=torch.float), persistent=False
+        )
+
+    def _get_weight_regularization_lambdas(self):
+        """Returns the lambda of each of the mixture layers, in the order of `head.layer_norms`, with 0 for the layers
+        without weight regularization."""
+        if self._weight_reg_norm is None:
+            return [0.0] * len(self.head.PROJECTIONS)
+        lambdas = {
+            "pi": self.head.hparams.lambda_pi,
+            "mu": self.head.hparams.lambda_mu,
+            "sigma": self.head.hparams.lambda_sigma,
+        }
+        return [max(float(lambdas[layer]), 0.0) for layer in self.head.PROJECTIONS]
+
+    def _weight_regularization(self) -> Tensor:
+        return torch.dot(self.head.layer_norms(self._weight_reg_norm), self._weight_reg_lambdas)
 
     # Redefining forward because TabTransformer flow is slightly different
     def forward(self, x: Dict):
-        if isinstance(self.backbone, TabTransformerBackbone):
-            if self.hparams.categorical_dim > 0:
+        if self._is_tab_transformer:
+            if self._categorical_dim > 0:
                 x_cat = self.embed_input({"categorical": x["categorical"]})
             x = self.compute_backbone({"categorical": x_cat, "continuous": x["continuous"]})
         else:
@@ -100,7 +131,7 @@ class MDNModel(BaseModel):
 
     def compute_backbone(self, x: Union[Dict, torch.Tensor]):
         # Returns output
-        if isinstance(self.backbone, TabTransformerBackbone):
+        if self._is_tab_transformer:
             x = self.backbone(x["categorical"], x["continuous"])
         else:
             x = self.backbone(x)
@@ -126,24 +157,8 @@ class MDNModel(BaseModel):
         # NLL Loss
         log_prob = self.head.log_prob(pi, sigma, mu, y)
         loss = torch.mean(-log_prob)
-        if self.head.hparams.weight_regularization is not None:
-            sigma_l1_reg = 0
-            pi_l1_reg = 0
-            mu_l1_reg = 0
-            if self.head.hparams.lambda_sigma > 0:
-                # Weight Regularization Sigma
-                sigma_params = torch.cat([x.view(-1) for x in self.head.sigma.parameters()])
-                sigma_l1_reg = self.head.hparams.lambda_sigma * torch.norm(
-                    sigma_params, self.head.hparams.weight_regularization
-                )
-            if self.head.hparams.lambda_pi > 0:
-                pi_params = torch.cat([x.view(-1) for x in self.head.pi.parameters()])
-                pi_l1_reg = self.head.hparams.lambda_pi * torch.norm(pi_params, self.head.hparams.weight_regularization)
-            if self.head.hparams.lambda_mu > 0:
-                mu_params = torch.cat([x.view(-1) for x in self.head.mu.parameters()])
-                mu_l1_reg = self.head.hparams.lambda_mu * torch.norm(mu_params, self.head.hparams.weight_regularization)
-
-            loss = loss + sigma_l1_reg + pi_l1_reg + mu_l1_reg
+        if self._weight_reg_enabled:
+            loss = loss + self._weight_regularization()
         self.log(
             f"{tag}_loss",
             loss,
@@ -159,7 +174,7 @@ class MDNModel(BaseModel):
         y = batch["target"]
         ret_value = self(batch)
         loss = self.calculate_loss(y, ret_value["pi"], ret_value["sigma"], ret_value["mu"], tag="train")
-        if self.head.hparams.speedup_training:
+        if self._speedup_training:
             pass
         else:
             y_hat = self.head.generate_point_predictions(ret_value["pi"], ret_value["sigma"], ret_value["mu"])
@@ -172,7 +187,10 @@ class MDNModel(BaseModel):
         self.calculate_loss(y, ret_value["pi"], ret_value["sigma"], ret_value["mu"], tag="valid")
         y_hat = self.head.generate_point_predictions(ret_value["pi"], ret_value["sigma"], ret_value["mu"])
         self.calculate_metrics(y, y_hat, tag="valid")
-        return y_hat, y, ret_value
+        self._update_validation_stats(ret_value)
+        if self.do_log_logits:
+            self._update_validation_plot_sample(y_hat, ret_value)
+        return y_hat, y
 
     def test_step(self, batch, batch_idx):
         y = batch["target"]
@@ -182,52 +200,62 @@ class MDNModel(BaseModel):
         self.calculate_metrics(y, y_hat, tag="test")
         return y_hat, y
 
-    def on_validation_batch_end(self, outputs, batch, batch_idx: int) -> None:
-        self._val_output.append(outputs)
-        super().on_validation_batch_end(outputs, batch, batch_idx)
+    def _update_validation_stats(self, ret_value: Dict[str, Tensor]) -> None:
+        """Accumulates the running sums of the mixture parameters, which are logged as means at the end of the
+        epoch."""
+        pi = nn.functional.gumbel_softmax(ret_value["pi"].detach(), tau=self._softmax_temperature, dim=-1)
+        # (3, B, K) --> (3, K) in the order of `head.PROJECTIONS`
+        self._val_sums += torch.stack([pi, ret_value["mu"].detach(), ret_value["sigma"].detach()]).sum(dim=1)
+        self._val_count += pi.size(0)
 
-    def on_validation_epoch_end(self) -> None:
-        pi = [
-            nn.functional.gumbel_softmax(output[2]["pi"], tau=self.head.hparams.softmax_temperature, dim=-1)
-            for output in self._val_output
-        ]
-        pi = torch.cat(pi).detach().cpu()
-        for i in range(self.head.hparams.num_gaussian):
-            self.log(
-                f"mean_pi_{i}",
-                pi[:, i].mean(),
-                on_epoch=True,
-                on_step=False,
-                logger=True,
-                prog_bar=False,
-            )
+    def _update_validation_plot_sample(self, y_hat: Tensor, ret_value: Dict[str, Tensor]) -> None:
+        """Keeps a uniform sample of at most `_VAL_PLOT_ROWS` validation rows of the logits and the mixture
+        parameters for the histograms, instead of all the outputs of the epoch."""
+        # (B, 1 + 3 * num_gaussian) --> logits, pi logits, mu, sigma
+        rows = torch.cat([y_hat, ret_value["pi"], ret_value["mu"], ret_value["sigma"]], dim=1).detach()
+        n_seen = self._val_plot_seen
+        n_fill = min(max(self._VAL_PLOT_ROWS - n_seen, 0), rows.size(0))
+        self._val_plot_sample[n_seen : n_seen + n_fill] = rows[:n_fill]
+        if n_fill < rows.size(0):
+            # Reservoir sampling: the t-th row seen replaces a random row of the sample with probability R / (t + 1)
+            t = torch.arange(n_seen + n_fill, n_seen + rows.size(0), device=rows.device)
+            slots = (torch.rand(t.size(0), device=rows.device) * (t + 1)).long()
+            keep = slots < self._VAL_PLOT_ROWS
+            self._val_plot_sample[slots[keep]] = rows[n_fill:][keep]
+        self._val_plot_seen += rows.size(0)
 
-        mu = [output[2]["mu"] for output in self._val_output]
-        mu = torch.cat(mu).detach().cpu()
-        for i in range(self.head.hparams.num_gaussian):
-            self.log(
-                f"mean_mu_{i}",
-                mu[:, i].mean(),
-                on_epoch=True,
-                on_step=False,
-                logger=True,
-                prog_bar=False,
+    def on_validation_epoch_start(self) -> None:
+        self._val_sums = torch.zeros(len(self.head.PROJECTIONS), self._num_gaussian, device=self.device)
+        self._val_count = 0
+        if self.do_log_logits:
+            self._val_plot_sample = torch.empty(
+                self._VAL_PLOT_ROWS, 1 + len(self.head.PROJECTIONS) * self._num_gaussian, device=self.device
             )
+            self._val_plot_seen = 0
+        super().on_validation_epoch_start()
 
-        sigma = [output[2]["sigma"] for output in self._val_output]
-        sigma = torch.cat(sigma).detach().cpu()
-        for i in range(self.head.hparams.num_gaussian):
-            self.log(
-                f"mean_sigma_{i}",
-                sigma[:, i].mean(),
-                on_epoch=True,
-                on_step=False,
-                logger=True,
-                prog_bar=False,
-            )
+    def on_validation_batch_end(self, outputs, batch, batch_idx: int) -> None:
+        # The logits are kept in the validation plot sample, so BaseModel does not collect them as well
+        super(BaseModel, self).on_validation_batch_end(outputs, batch, batch_idx)
+
+    def on_validation_epoch_end(self) -> None:
+        # Only the (3, num_gaussian) means leave the device, in one transfer, and are logged in one call
+        means = (self._val_sums / self._val_count).tolist()
+        self.log_dict(
+            {
+                f"mean_{name}_{i}": value
+                for name, stat_means in zip(self.head.PROJECTIONS, means)
+                for i, value in enumerate(stat_means)
+            },
+            on_epoch=True,
+            on_step=False,
+            logger=True,
+            prog_bar=False,
+        )
         if self.do_log_logits:
-            logits = [output[0] for output in self._val_output]
-            logits = torch.cat(logits).detach().cpu()
+            sample = self._val_plot_sample[: min(self._val_plot_seen, self._VAL_PLOT_ROWS)]
+            # The logits are the first column, followed by pi, mu and sigma
+            logits = sample[:, :1].cpu()
             fig = self.create_plotly_histogram(logits.unsqueeze(1), "logits")
             wandb.log(
                 {
@@ -237,6 +265,10 @@ class MDNModel(BaseModel):
                 commit=False,
             )
             if self.head.hparams.log_debug_plot:
+                values = sample[:, 1:].view(-1, len(self.head.PROJECTIONS), self._num_gaussian).transpose(0, 1)
+                # The gumbel softmax is applied once on all the pi logits
+                pi = nn.functional.gumbel_softmax(values[0], tau=self._softmax_temperature, dim=-1)
+                pi, mu, sigma = pi.cpu(), values[1].cpu(), values[2].cpu()
                 fig = self.create_plotly_histogram(pi, "pi", bin_dict={"start": 0.0, "end": 1.0, "size": 0.1})
                 wandb.log(
                     {
@@ -263,4 +295,5 @@ class MDNModel(BaseModel):
                     },
                     commit=False,
                 )
-        self._val_output = []
+            self._val_plot_sample = None
+        super(BaseModel, self).on_validation_epoch_end()
@@ -99,7 +99,9 @@ class MixedEmbedding1dLayer(nn.Module):
                     x_cat.append(self.one_hot_layers[str(i)](categorical_data[:, i]))
                     x_cat_orig.append(categorical_data[:, i : i + 1])
                 else:
-                    x_embed.append(self.embedding_layer[str(i)](categorical_data[:, i]))
+                    x_embed.append(
+                        nn.functional.embedding(categorical_data[:, i], self.embedding_layer[str(i)].weight)
+                    )
             # (B, N, E)
             x_cat = torch.cat(x_cat, 1) if len(x_cat) > 0 else None
             x_cat_orig = torch.cat(x_cat_orig, 1) if len(x_cat_orig) > 0 else None
@@ -10,6 +10,7 @@ from pytorch_tabular import TabularModel
 from pytorch_tabular.categorical_encoders import CategoricalEmbeddingTransformer
 from pytorch_tabular.config import DataConfig, OptimizerConfig, TrainerConfig
 from pytorch_tabular.models import CategoryEmbeddingModelConfig
+from pytorch_tabular.models.common.layers import Embedding1dLayer
 
 
 def fake_metric(y_hat, y):
@@ -218,3 +219,132 @@ def test_embedding_transformer(regression_data):
     embed_cols = [col for col in train_transform.columns if "HouseAgeBin_embed_dim" in col]
     assert len(train["HouseAgeBin"].unique()) + 1 == len(transformer._mapping["HouseAgeBin"].keys())
     assert all(val.shape[0] == len(embed_cols) for val in transformer._mapping["HouseAgeBin"].values())
+
+
+def test_fold_continuous_batch_norm(regression_data, tmp_path_factory):
+    (train, test, target) = regression_data
+    data_config = DataConfig(
+        target=target,
+        continuous_cols=[
+            "AveRooms",
+            "AveBedrms",
+            "Population",
+            "AveOccup",
+            "Latitude",
+            "Longitude",
+        ],
+        categorical_cols=["HouseAgeBin"],
+    )
+    model_config = CategoryEmbeddingModelConfig(task="regression", batch_norm_continuous_input=True)
+    trainer_config = TrainerConfig(
+        max_epochs=1,
+        checkpoints=None,
+        early_stopping=None,
+        accelerator="cpu",
+        fast_dev_run=True,
+    )
+    optimizer_config = OptimizerConfig()
+
+    tabular_model = TabularModel(
+        data_config=data_config,
+        model_config=model_config,
+        optimizer_config=optimizer_config,
+        trainer_config=trainer_config,
+    )
+    tabular_model.fit(train=train)
+    pred_df = tabular_model.predict(test)
+    tabular_model.model.fold_continuous_batch_norm()
+    assert isinstance(tabular_model.model.embedding_layer.normalizing_batch_norm, torch.nn.Identity)
+    folded_pred_df = tabular_model.predict(test)
+    assert np.allclose(pred_df.values, folded_pred_df.values, atol=1e-5)
+    # the folded model should be saved and loaded back without the BatchNorm
+    sv_dir = tmp_path_factory.mktemp("saved_model")
+    tabular_model.save_model(str(sv_dir))
+    new_mdl = TabularModel.load_model(str(sv_dir))
+    assert isinstance(new_mdl.model.embedding_layer.normalizing_batch_norm, torch.nn.Identity)
+    loaded_pred_df = new_mdl.predict(test)
+    assert np.allclose(folded_pred_df.values, loaded_pred_df.values, atol=1e-5)
+
+
+def _fit_regression_model(regression_data, **model_config_params):
+    (train, test, target) = regression_data
+    data_config = DataConfig(
+        target=target,
+        continuous_cols=[
+            "AveRooms",
+            "AveBedrms",
+            "Population",
+            "AveOccup",
+            "Latitude",
+            "Longitude",
+        ],
+        categorical_cols=["HouseAgeBin"],
+    )
+    model_config = CategoryEmbeddingModelConfig(task="regression", **model_config_params)
+    trainer_config = TrainerConfig(
+        max_epochs=1,
+        checkpoints=None,
+        early_stopping=None,
+        accelerator="cpu",
+        fast_dev_run=True,
+    )
+    optimizer_config = OptimizerConfig()
+
+    tabular_model = TabularModel(
+        data_config=data_config,
+        model_config=model_config,
+        optimizer_config=optimizer_config,
+        trainer_config=trainer_config,
+    )
+    tabular_model.fit(train=train)
+    return tabular_model
+
+
+def test_compile(regression_data):
+    (train, test, target) = regression_data
+    tabular_model = _fit_regression_model(regression_data)
+    compiled_tabular_model = _fit_regression_model(regression_data, compile=True)
+    # compiled in place, so the saved weights are interchangeable with the uncompiled model
+    assert compiled_tabular_model.model.state_dict().keys() == tabular_model.model.state_dict().keys()
+    pred_df = tabular_model.predict(test)
+    compiled_pred_df = compiled_tabular_model.predict(test)
+    assert np.allclose(pred_df.values, compiled_pred_df.values, atol=1e-4)
+
+
+def test_half_embeddings(regression_data):
+    (train, test, target) = regression_data
+    tabular_model = _fit_regression_model(regression_data)
+    pred_df = tabular_model.predict(test)
+    train_transform = CategoricalEmbeddingTransformer(tabular_model).fit_transform(train)
+    tabular_model.model.embedding_layer.to_half_embeddings(torch.bfloat16)
+    half_pred_df = tabular_model.predict(test)
+    assert np.allclose(pred_df.values, half_pred_df.values, rtol=1e-2, atol=1e-2)
+    # the embeddings stored in half precision should still be extracted
+    half_train_transform = CategoricalEmbeddingTransformer(tabular_model).fit_transform(train)
+    embed_cols = [col for col in train_transform.columns if "HouseAgeBin_embed_dim" in col]
+    assert np.allclose(train_transform[embed_cols].values, half_train_transform[embed_cols].values, atol=1e-2)
+
+
+@pytest.mark.parametrize("batch_size", [8, 8192])
+def test_embedding_layer_fused_table(batch_size):
+    embedding_dims = [(9, 5), (4, 2), (100, 7), (3, 2)]
+    embedding_layer = Embedding1dLayer(continuous_dim=3, categorical_embedding_dims=embedding_dims)
+    # state dicts saved with one nn.Embedding per categorical column should still load
+    per_column_layers = torch.nn.ModuleList([torch.nn.Embedding(c, d) for c, d in embedding_dims])
+    embedding_layer.load_state_dict(
+        {f"cat_embedding_layers.{i}.weight": layer.weight.detach() for i, layer in enumerate(per_column_layers)}
+    )
+    # small batches are looked up from the padded table in one call, large ones column by column
+    x = {
+        "continuous": torch.randn(batch_size, 3),
+        "categorical": torch.stack([torch.randint(0, c, (batch_size,)) for c, _ in embedding_dims], dim=1),
+    }
+    expected = torch.cat(
+        [x["continuous"]] + [layer(x["categorical"][:, i]) for i, layer in enumerate(per_column_layers)], dim=1
+    )
+    assert torch.allclose(embedding_layer(x), expected)
+    assert [tuple(layer.weight.shape) for layer in embedding_layer.cat_embedding_layers] == embedding_dims
+    # an index beyond the cardinality of a column must not read the rows of the next column of the table
+    x["categorical"][0, 1] = 4
+    with pytest.raises((RuntimeError, IndexError)):
+        embedding_layer(x)
@@ -2,10 +2,12 @@
 """Tests for `pytorch_tabular` package."""
 
 import pytest
+import torch
 
 from pytorch_tabular import TabularModel
 from pytorch_tabular.config import DataConfig, OptimizerConfig, TrainerConfig
 from pytorch_tabular.models import MDNConfig
+from pytorch_tabular.models.common.heads import MixtureDensityHead, MixtureDensityHeadConfig
 
 
 @pytest.mark.parametrize("multi_target", [False])
@@ -128,3 +130,76 @@ def test_classification(
             trainer_config=trainer_config,
         )
         tabular_model.fit(train=train)
+
+
+@pytest.mark.parametrize("sigma_bias_flag", [False, True])
+def test_mixture_density_head_legacy_state_dict(sigma_bias_flag):
+    head = MixtureDensityHead(MixtureDensityHeadConfig(num_gaussian=3, input_dim=4, sigma_bias_flag=sigma_bias_flag))
+    # state dicts saved with separate `pi`, `mu` and `sigma` linear layers should still load
+    legacy_layers = {
+        "pi": torch.nn.Linear(4, 3),
+        "mu": torch.nn.Linear(4, 3),
+        "sigma": torch.nn.Linear(4, 3, bias=sigma_bias_flag),
+    }
+    head.load_state_dict(
+        {f"{name}.{key}": value for name, layer in legacy_layers.items() for key, value in layer.state_dict().items()}
+    )
+    x = torch.randn(8, 4)
+    pi, sigma, mu = head(x)
+    assert torch.allclose(pi, legacy_layers["pi"](x))
+    assert torch.allclose(mu, legacy_layers["mu"](x))
+    assert torch.allclose(sigma, torch.nn.ELU()(legacy_layers["sigma"](x)) + 1 + 1e-15)
+
+
+def test_validation_plot_sample_reservoir(regression_data):
+    (train, test, target) = regression_data
+    data_config = DataConfig(
+        target=target,
+        continuous_cols=["AveRooms", "AveBedrms", "Population", "AveOccup", "Latitude", "Longitude"],
+        categorical_cols=["HouseAgeBin"],
+    )
+    model_config = MDNConfig(
+        task="regression",
+        head_config={"num_gaussian": 1},
+        backbone_config_class="CategoryEmbeddingModelConfig",
+        backbone_config_params={"task": "backbone"},
+    )
+    trainer_config = TrainerConfig(
+        max_epochs=1,
+        checkpoints=None,
+        early_stopping=None,
+        accelerator="cpu",
+        fast_dev_run=True,
+    )
+    tabular_model = TabularModel(
+        data_config=data_config,
+        model_config=model_config,
+        optimizer_config=OptimizerConfig(),
+        trainer_config=trainer_config,
+    )
+    tabular_model.fit(train=train)
+    model = tabular_model.model
+    # log the logits, as with wandb, and keep room for 5 of the 12 rows in the sample for the histograms
+    model.do_log_logits = True
+    model._val_logits = []
+    model._VAL_PLOT_ROWS = 5
+
+    torch.manual_seed(0)
+    n_rows, n_trials = 12, 2000
+    counts = torch.zeros(n_rows)
+    for _ in range(n_trials):
+        model.on_validation_epoch_start()
+        for batch_idx, batch in enumerate(torch.arange(n_rows, dtype=torch.float).split(4)):
+            # every column of a row holds the index of the row
+            row = batch.unsqueeze(1)
+            model._update_validation_plot_sample(row, {"pi": row, "mu": row, "sigma": row})
+            model.on_validation_batch_end((row, row), {"target": row}, batch_idx)
+        assert model._val_plot_seen == n_rows
+        kept = model._val_plot_sample[:, 0].long()
+        assert (model._val_plot_sample == kept.unsqueeze(1)).all()
+        assert kept.unique().numel() == 5
+        counts[kept] += 1
+    # the logits are only kept in the sample
+    assert model._val_logits == []
+    # every row seen ends up in the sample with the same probability
+    assert torch.allclose(counts / n_trials, torch.full((n_rows,), 5 / n_rows), atol=0.05)